@@ -1,19 +1,24 @@
-from flask import Flask, request, render_template_string, jsonify, flash, redirect, url_for
+from flask import Flask, request, jsonify, flash, redirect, url_for
+import hashlib
+import json
 import os
+import shutil
 import tempfile
 import subprocess
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.cookiejar import DefaultCookiePolicy
 import numpy as np
 from urllib.parse import urlparse
 import requests
+from requests.adapters import HTTPAdapter
 import re
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.preprocessing import StandardScaler
 import joblib
-import warnings
-warnings.filterwarnings('ignore')
 
-# Disable numba JIT compilation to avoid memory issues
-os.environ['NUMBA_DISABLE_JIT'] = '1'
+# Keep numba's compiled-kernel cache somewhere writable on read-only app filesystems
+os.environ.setdefault('NUMBA_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'numba_cache'))
 
 # Import librosa after setting environment variable
 import librosa
@@ -21,6 +26,24 @@ import librosa
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-here'
 
+# Audio is decoded by ffmpeg straight to this rate, so no resampling happens in Python
+SAMPLE_RATE = 16000
+MAX_DURATION = 30  # seconds
+
+# STFT settings shared by every spectral feature (and the optional mel filterbank)
+FRAME_LENGTH = 2048
+HOP_LENGTH = 512
+
+# On-disk cache of classification results keyed by a hash of the decoded audio,
+# shared by all workers and pruned to CACHE_BYTES_LIMIT
+CACHE_DIR = os.environ.get('ACCENT_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'accent_cache'))
+CACHE_BYTES_LIMIT = int(os.environ.get('ACCENT_CACHE_BYTES', 64 * 1024 * 1024))
+memory = joblib.Memory(CACHE_DIR, verbose=0)
+
+# Part of every cache key; bump whenever feature extraction or scoring changes
+# so results cached by older code are not served after a deploy
+FEATURES_VERSION = 1
+
 class AccentAnalyzer:
     def __init__(self):
         # Initialize with a simple rule-based classifier
@@ -52,51 +75,105 @@ class AccentAnalyzer:
                 'speaking_rate': 145
             }
         }
+        
+        # Stack the patterns into arrays so every accent is scored in one pass
+        self._accent_names = list(self.accent_patterns)
+        self._formant_mat = np.array([p['formant_ratios'] for p in self.accent_patterns.values()])
+        self._pitch_vec = np.array([p['pitch_variance'] for p in self.accent_patterns.values()])
+        self._rate_vec = np.array([p['speaking_rate'] for p in self.accent_patterns.values()])
+        
+        # Identifies the pattern table, so cached results are dropped when it changes
+        self.fingerprint = hashlib.sha1(repr(self.accent_patterns).encode()).hexdigest()[:16]
+        
+        # 20-band mel filterbank for the optional MFCCs, built on first use since the default path skips them
+        self._mel_basis = None
     
-    def extract_audio_features(self, audio_path):
-        """Extract acoustic features from audio file - optimized for low memory"""
+    def extract_audio_features(self, y, sr=SAMPLE_RATE, include_mfcc=False):
+        """Extract acoustic features from a mono float32 signal - optimized for low memory
+        
+        MFCCs are not used by classify_accent, so they are only computed when
+        include_mfcc is True (e.g. for a future trained model). Returns None if
+        extraction fails outright; if a single feature fails it falls back to a
+        default value and sets features['used_fallback'].
+        """
         try:
-            # Load audio file with lower sample rate to save memory
-            y, sr = librosa.load(audio_path, sr=16000, duration=30)  # Limit to 30 seconds
-            
             # Extract features
             features = {}
             
-            # Simplified pitch extraction to avoid numba issues
+            # Muted or near-silent clips carry no accent information, so skip all spectral work
+            if y.size == 0 or float(np.sqrt(np.mean(np.square(y)))) < 1e-4:
+                print("Audio is silent, using default features")
+                return self._default_features()
+            
+            # Drop leading/trailing silence so the spectral work only covers speech
+            y, _ = librosa.effects.trim(y, top_db=25, frame_length=FRAME_LENGTH, hop_length=HOP_LENGTH)
+            if y.size < sr:
+                print("Less than a second of speech, using default features")
+                return self._default_features()
+            
+            # Compute the magnitude spectrogram once and share it between all spectral features
+            S = np.abs(librosa.stft(y, n_fft=FRAME_LENGTH, hop_length=HOP_LENGTH, dtype=np.complex64))
+            
+            # Pitch and formant proxies all come from the shared spectrogram, so they share one fallback
             try:
-                # Use alternative pitch detection method
-                hop_length = 512
-                frame_length = 2048
+                # Get spectral centroid (simpler than pitch tracking); kept 2-D so
+                # spectral_bandwidth can reuse it instead of recomputing it
+                centroid = librosa.feature.spectral_centroid(S=S, sr=sr)
+                spectral_rolloff = librosa.feature.spectral_rolloff(S=S, sr=sr)
+                spectral_bandwidth = librosa.feature.spectral_bandwidth(S=S, sr=sr, centroid=centroid)
                 
-                # Get spectral centroid (simpler than pitch tracking)
-                spectral_centroids = librosa.feature.spectral_centroid(y=y, sr=sr, hop_length=hop_length)[0]
-                features['spectral_centroid'] = float(np.mean(spectral_centroids))
-                features['spectral_variance'] = float(np.var(spectral_centroids))
+                centroid_mean = float(np.mean(centroid))
+                rolloff_mean = float(np.mean(spectral_rolloff))
+                bandwidth_mean = float(np.mean(spectral_bandwidth))
                 
                 # Use spectral variance as pitch variance proxy
-                features['pitch_variance'] = features['spectral_variance'] / features['spectral_centroid'] if features['spectral_centroid'] > 0 else 0.15
-                features['mean_pitch'] = features['spectral_centroid']
+                features['spectral_centroid'] = centroid_mean
+                features['spectral_variance'] = float(np.var(centroid))
+                features['pitch_variance'] = features['spectral_variance'] / centroid_mean if centroid_mean > 0 else 0.15
+                features['mean_pitch'] = centroid_mean
+                
+                # Create formant ratios from spectral features
+                if centroid_mean > 0:
+                    features['formant_ratios'] = [
+                        bandwidth_mean / centroid_mean,
+                        rolloff_mean / centroid_mean,
+                        rolloff_mean / bandwidth_mean if bandwidth_mean > 0 else 1.5
+                    ]
+                else:
+                    features['formant_ratios'] = [1.2, 2.0, 1.6]
                 
-            except Exception as pitch_error:
-                print(f"Pitch extraction failed, using defaults: {pitch_error}")
+            except Exception as spectral_error:
+                print(f"Spectral feature extraction failed, using defaults: {spectral_error}")
                 features['mean_pitch'] = 200.0
                 features['pitch_variance'] = 0.15
                 features['spectral_centroid'] = 200.0
+                features['formant_ratios'] = [1.2, 2.0, 1.6]
+                features['used_fallback'] = True
             
             # MFCC features - reduce number to save memory
-            try:
-                mfccs = librosa.feature.mfcc(y=y, sr=sr, n_mfcc=5, hop_length=hop_length)  # Reduced from 13 to 5
-                for i in range(5):
-                    features[f'mfcc_{i}'] = float(np.mean(mfccs[i]))
-            except Exception as mfcc_error:
-                print(f"MFCC extraction failed, using defaults: {mfcc_error}")
-                for i in range(5):
-                    features[f'mfcc_{i}'] = 0.0
+            if include_mfcc:
+                try:
+                    if sr != SAMPLE_RATE:
+                        mel_basis = librosa.filters.mel(sr=sr, n_fft=FRAME_LENGTH, n_mels=20)
+                    else:
+                        if self._mel_basis is None:
+                            self._mel_basis = librosa.filters.mel(sr=SAMPLE_RATE, n_fft=FRAME_LENGTH, n_mels=20)
+                        mel_basis = self._mel_basis
+                    mel_spec = mel_basis @ S**2
+                    mfccs = librosa.feature.mfcc(S=librosa.power_to_db(mel_spec), n_mfcc=5)  # Reduced from 13 to 5
+                    features.update({f'mfcc_{i}': float(m) for i, m in enumerate(mfccs.mean(axis=1))})
+                except Exception as mfcc_error:
+                    print(f"MFCC extraction failed, using defaults: {mfcc_error}")
+                    for i in range(5):
+                        features[f'mfcc_{i}'] = 0.0
+                    features['used_fallback'] = True
             
             # Speaking rate estimation using zero crossing rate (simpler than onset detection)
             try:
-                zcr = librosa.feature.zero_crossing_rate(y, hop_length=hop_length)[0]
-                features['speaking_rate'] = float(np.mean(zcr) * sr / hop_length * 60)  # Rough approximation
+                # Count sign changes over the whole signal in one pass instead of framing it;
+                # the mean crossing rate per sample matches the mean of the per-frame rates
+                zcr_mean = np.count_nonzero(np.diff(np.signbit(y))) / max(len(y) - 1, 1)
+                features['speaking_rate'] = float(zcr_mean * sr / HOP_LENGTH * 60)  # Rough approximation
                 
                 # Normalize speaking rate to reasonable range
                 if features['speaking_rate'] > 300:
@@ -107,117 +184,201 @@ class AccentAnalyzer:
             except Exception as rate_error:
                 print(f"Speaking rate estimation failed: {rate_error}")
                 features['speaking_rate'] = 140.0
-            
-            # Simplified formant approximation
-            try:
-                # Use spectral features as formant proxies
-                spectral_rolloff = librosa.feature.spectral_rolloff(y=y, sr=sr, hop_length=hop_length)[0]
-                spectral_bandwidth = librosa.feature.spectral_bandwidth(y=y, sr=sr, hop_length=hop_length)[0]
-                
-                rolloff_mean = float(np.mean(spectral_rolloff))
-                bandwidth_mean = float(np.mean(spectral_bandwidth))
-                centroid_mean = features['spectral_centroid']
-                
-                # Create formant ratios from spectral features
-                if centroid_mean > 0:
-                    features['formant_ratios'] = [
-                        bandwidth_mean / centroid_mean if centroid_mean > 0 else 1.2,
-                        rolloff_mean / centroid_mean if centroid_mean > 0 else 2.0,
-                        rolloff_mean / bandwidth_mean if bandwidth_mean > 0 else 1.5
-                    ]
-                else:
-                    features['formant_ratios'] = [1.2, 2.0, 1.6]
-                    
-            except Exception as formant_error:
-                print(f"Formant estimation failed: {formant_error}")
-                features['formant_ratios'] = [1.2, 2.0, 1.6]
+                features['used_fallback'] = True
             
             return features
             
         except Exception as e:
             print(f"Error extracting features: {e}")
-            # Return default features if everything fails
-            return {
-                'mean_pitch': 200.0,
-                'pitch_variance': 0.15,
-                'spectral_centroid': 200.0,
-                'speaking_rate': 140.0,
-                'formant_ratios': [1.2, 2.0, 1.6],
-                'mfcc_0': 0.0, 'mfcc_1': 0.0, 'mfcc_2': 0.0, 'mfcc_3': 0.0, 'mfcc_4': 0.0
-            }
+            # Don't dress a failure up as defaults; callers must not cache it as a real result
+            return None
+    
+    def _default_features(self):
+        """Fallback features used when the audio cannot be analyzed"""
+        return {
+            'mean_pitch': 200.0,
+            'pitch_variance': 0.15,
+            'spectral_centroid': 200.0,
+            'speaking_rate': 140.0,
+            'formant_ratios': [1.2, 2.0, 1.6],
+            'mfcc_0': 0.0, 'mfcc_1': 0.0, 'mfcc_2': 0.0, 'mfcc_3': 0.0, 'mfcc_4': 0.0
+        }
     
     def classify_accent(self, features):
         """Classify accent based on extracted features"""
         if not features:
             return None, 0, "Could not extract audio features"
         
-        scores = {}
+        # extract_audio_features always fills these keys, falling back to defaults
+        formant_diff = np.abs(self._formant_mat - np.asarray(features['formant_ratios'])).sum(axis=1)
+        pitch_diff = np.abs(self._pitch_vec - features['pitch_variance'])
+        rate_diff = np.abs(self._rate_vec - features['speaking_rate'])
         
-        for accent, patterns in self.accent_patterns.items():
-            score = 0
-            
-            # Compare formant ratios
-            if 'formant_ratios' in features:
-                formant_diff = sum(abs(a - b) for a, b in zip(features['formant_ratios'], patterns['formant_ratios']))
-                formant_score = max(0, 1 - formant_diff / 3)  # Normalize
-                score += formant_score * 0.4
-            
-            # Compare pitch variance
-            if 'pitch_variance' in features:
-                pitch_diff = abs(features['pitch_variance'] - patterns['pitch_variance'])
-                pitch_score = max(0, 1 - pitch_diff / 0.5)  # Normalize
-                score += pitch_score * 0.3
-            
-            # Compare speaking rate
-            if 'speaking_rate' in features:
-                rate_diff = abs(features['speaking_rate'] - patterns['speaking_rate'])
-                rate_score = max(0, 1 - rate_diff / 100)  # Normalize
-                score += rate_score * 0.3
-            
-            scores[accent] = score
+        # Normalize each distance into a score and combine with fixed weights
+        scores = (np.maximum(0, 1 - formant_diff / 3) * 0.4
+                  + np.maximum(0, 1 - pitch_diff / 0.5) * 0.3
+                  + np.maximum(0, 1 - rate_diff / 100) * 0.3)
         
         # Find best match
-        best_accent = max(scores, key=scores.get)
-        confidence = scores[best_accent] * 100
+        best = int(scores.argmax())
+        best_accent = self._accent_names[best]
+        confidence = float(scores[best]) * 100
         
         # Generate explanation
         explanation = f"Analysis based on spectral patterns and speaking characteristics. "
-        explanation += f"Detected speaking rate: {features.get('speaking_rate', 0):.0f} units/min, "
-        explanation += f"Spectral variance: {features.get('pitch_variance', 0):.3f}"
+        explanation += f"Detected speaking rate: {features['speaking_rate']:.0f} units/min, "
+        explanation += f"Spectral variance: {features['pitch_variance']:.3f}"
         
         return best_accent, confidence, explanation
 
-def download_video(url):
-    """Download video from URL"""
+# URL patterns, compiled once at import
+VIDEO_DOMAIN_RE = re.compile(r'(?:loom|youtube|vimeo|dropbox|drive\.google|googleapis)\.com', re.IGNORECASE)
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.wmv', '.flv', '.webm')
+GDRIVE_FILE_ID_RE = re.compile(r'(?:/file/d/|[?&]id=)([\w-]+)')
+GDRIVE_CONFIRM_RE = re.compile(r'(?:confirm=|name="confirm" value=")([0-9A-Za-z_-]+)')
+
+# Downloaded videos are kept here by URL, revalidated with their ETag on the next request,
+# and pruned least-recently-used first once they exceed VIDEO_CACHE_BYTES
+VIDEO_CACHE_DIR = os.environ.get('ACCENT_VIDEO_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'video_cache'))
+VIDEO_CACHE_BYTES = int(os.environ.get('ACCENT_VIDEO_CACHE_BYTES', 512 * 1024 * 1024))
+
+# One keep-alive session with a pooled adapter shared by every worker thread; urllib3's
+# pool is thread-safe and we only issue plain GETs. Its jar refuses all cookies so nothing
+# (e.g. Drive's download_warning cookie) carries over between unrelated users' requests
+http_session = requests.Session()
+http_session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+http_adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16)
+http_session.mount('http://', http_adapter)
+http_session.mount('https://', http_adapter)
+http_session.headers['Accept-Encoding'] = 'identity'  # Video is already compressed
+
+def link_or_copy(src, dst):
+    """Hard-link src to dst, falling back to a copy across filesystems"""
     try:
-        # Handle Google Drive links
-        if 'drive.google.com' in url:
-            # Extract file ID from Google Drive URL
-            if '/file/d/' in url:
-                file_id = url.split('/file/d/')[1].split('/')[0]
-                # Convert to direct download URL
-                url = f"https://drive.google.com/uc?export=download&id={file_id}"
-            
-            # Handle Google Drive download with confirmation
-            session = requests.Session()
-            response = session.get(url, stream=True, timeout=30)
-            
-            # Check if we need to handle download confirmation
-            if 'download_warning' in response.text or 'virus scan warning' in response.text:
-                # Look for the actual download link
-                import re
-                confirm_token = None
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+def read_video_cache(cache_base):
+    """Return (etag, body_path) for a cached download, or (None, None) if there is none"""
+    try:
+        with open(cache_base + '.json') as f:
+            meta = json.load(f)
+        body_path = os.path.join(VIDEO_CACHE_DIR, meta['body'])
+        if os.path.exists(body_path):
+            return meta['etag'], body_path
+    except (OSError, ValueError, KeyError):
+        pass
+    return None, None
+
+def store_video_cache(cache_base, video_path, etag):
+    """Cache a downloaded video under its ETag.
+    
+    Every body gets a unique name and the metadata file naming it is replaced last, in one
+    os.replace, so a body and its ETag always change together even with concurrent downloads.
+    """
+    os.makedirs(VIDEO_CACHE_DIR, exist_ok=True)
+    _, old_body = read_video_cache(cache_base)
+    
+    token = uuid.uuid4().hex
+    body_path = f"{cache_base}.{token}.mp4"
+    link_or_copy(video_path, body_path)
+    staging_meta = f"{cache_base}.{token}.json.tmp"
+    with open(staging_meta, 'w') as f:
+        json.dump({'etag': etag, 'body': os.path.basename(body_path)}, f)
+    os.replace(staging_meta, cache_base + '.json')
+    
+    if old_body:
+        try:
+            os.unlink(old_body)
+        except OSError:
+            pass
+
+def prune_video_cache():
+    """Evict whole cache entries, least recently used first, until the cache fits in VIDEO_CACHE_BYTES.
+    
+    An entry is every file named after one cache key (its metadata, body and any staging files),
+    so metadata and body are always removed together; its age is that of its newest file.
+    """
+    entries = {}
+    for entry in os.scandir(VIDEO_CACHE_DIR):
+        if entry.is_file():
+            stat = entry.stat()
+            key = entry.name.split('.', 1)[0]
+            last_used, size, paths = entries.get(key, (0.0, 0, []))
+            entries[key] = (max(last_used, stat.st_mtime), size + stat.st_size, paths + [entry.path])
+    
+    total = sum(size for _, size, _ in entries.values())
+    for _, size, paths in sorted(entries.values(), key=lambda e: e[0]):
+        if total <= VIDEO_CACHE_BYTES:
+            break
+        for path in paths:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+        total -= size
+
+def request_video(url, headers):
+    """Start a streaming GET for a video URL, handling Google Drive's download confirmation"""
+    # Handle Google Drive links
+    if 'drive.google.com' in url:
+        # Extract file ID from Google Drive URL (either /file/d/<id>/ or ...?id=<id>)
+        match = GDRIVE_FILE_ID_RE.search(url)
+        file_id = match.group(1) if match else None
+        if file_id:
+            # Convert to direct download URL
+            url = f"https://drive.google.com/uc?export=download&id={file_id}"
+        
+        # Handle Google Drive download with confirmation
+        response = http_session.get(url, stream=True, timeout=(5, 30), headers=headers)
+        
+        # Check if we need to handle download confirmation; only an HTML page can be the
+        # warning, so a real video body is never read here and stays available for streaming
+        if 'text/html' in response.headers.get('content-type', '').lower():
+            # Take the confirm token from the warning page itself, falling back to the
+            # older download_warning cookie
+            match = GDRIVE_CONFIRM_RE.search(response.text)
+            confirm_token = match.group(1) if match else None
+            if not confirm_token:
                 for key, value in response.cookies.items():
                     if key.startswith('download_warning'):
                         confirm_token = value
                         break
-                
-                if confirm_token:
-                    url = f"https://drive.google.com/uc?export=download&confirm={confirm_token}&id={file_id}"
-                    response = session.get(url, stream=True, timeout=30)
-        else:
-            # Regular download
-            response = requests.get(url, stream=True, timeout=30)
+            
+            if confirm_token and file_id:
+                url = f"https://drive.google.com/uc?export=download&confirm={confirm_token}&id={file_id}"
+                # The session stores no cookies, so pass this download's own cookies along
+                response = http_session.get(url, stream=True, timeout=(5, 30), headers=headers,
+                                            cookies=response.cookies)
+        return response
+    
+    # Regular download
+    return http_session.get(url, stream=True, timeout=(5, 30), headers=headers)
+
+def download_video(url):
+    """Download video from URL into a temporary file the caller must delete"""
+    try:
+        # Conditional GET against the cached copy of this URL, if we have one
+        cache_base = os.path.join(VIDEO_CACHE_DIR, hashlib.sha1(url.encode()).hexdigest()[:16])
+        cached_etag, cached_body = read_video_cache(cache_base)
+        response = request_video(url, {'If-None-Match': cached_etag} if cached_etag else {})
+        
+        if response.status_code == 304:
+            # Unchanged since we cached it; hand out a fresh link to the cached file
+            response.close()
+            tmp_path = os.path.join(tempfile.gettempdir(), f"{uuid.uuid4().hex}.mp4")
+            try:
+                link_or_copy(cached_body, tmp_path)
+                # Mark the whole entry as recently used for pruning
+                os.utime(cached_body)
+                os.utime(cache_base + '.json')
+                return tmp_path
+            except OSError:
+                # Pruned or replaced since we read the metadata; fetch it unconditionally
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+                response = request_video(url, {})
         
         response.raise_for_status()
         
@@ -227,39 +388,65 @@ def download_video(url):
             print("Error: Got HTML instead of video file. Check if the URL is a direct download link.")
             return None
         
-        # Create temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.mp4') as tmp_file:
-            for chunk in response.iter_content(chunk_size=8192):
-                tmp_file.write(chunk)
-            return tmp_file.name
+        # Create temporary file, copying the body in 1 MiB blocks
+        response.raw.decode_content = True
+        tmp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.mp4')
+        try:
+            with tmp_file:
+                shutil.copyfileobj(response.raw, tmp_file, length=1 << 20)
+        except Exception:
+            # Don't leave a partial download behind
+            os.unlink(tmp_file.name)
+            raise
+        
+        # Keep a link in the cache when the server gave us a validator to check it with later
+        etag = response.headers.get('ETag')
+        if etag:
+            try:
+                store_video_cache(cache_base, tmp_file.name, etag)
+                prune_video_cache()
+            except OSError as cache_error:
+                print(f"Could not cache downloaded video: {cache_error}")
+        
+        return tmp_file.name
     except Exception as e:
         print(f"Error downloading video: {e}")
         return None
 
-def extract_audio_from_video(video_path):
-    """Extract audio from video using ffmpeg - optimized for low memory"""
+def decode_audio_from_video(source):
+    """Decode the audio track of a video file or http(s) URL straight into a float32 array using ffmpeg"""
     try:
-        # Create temporary audio file
-        audio_path = tempfile.mktemp(suffix='.wav')
+        input_options = []
+        if source.startswith(('http://', 'https://')):
+            # ffmpeg fetches the URL itself, decoding while the bytes arrive; only allow
+            # network protocols so a crafted URL can't make it read local files
+            input_options = ['-protocol_whitelist', 'http,https,tcp,tls', '-rw_timeout', '30000000']
         
-        # Use ffmpeg to extract audio with optimization for memory
+        # Stream raw 16-bit PCM to stdout instead of writing a temporary WAV file
         cmd = [
-            'ffmpeg', '-i', video_path,
-            '-vn',  # No video
+            'ffmpeg', '-nostdin', '-hide_banner',
+            *input_options,
+            '-i', source,
+            '-map', '0:a:0',  # Only demux and decode the first audio stream
+            '-vn', '-sn', '-dn',  # No video, subtitle or data streams
+            '-f', 's16le',  # Raw little-endian samples, no container
             '-acodec', 'pcm_s16le',  # Audio codec
-            '-ar', '16000',  # Lower sample rate to save memory
+            '-ar', str(SAMPLE_RATE),  # Lower sample rate to save memory
             '-ac', '1',  # Mono
-            '-t', '30',  # Limit to first 30 seconds
-            '-y',  # Overwrite output
-            audio_path
+            '-t', str(MAX_DURATION),  # Limit to the first MAX_DURATION seconds
+            '-loglevel', 'error',
+            '-'
         ]
         
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=60)
+        result = subprocess.run(cmd, capture_output=True, timeout=60)
         
-        if result.returncode == 0:
-            return audio_path
+        if result.returncode == 0 and result.stdout:
+            # Convert to float32 once, then scale in place rather than allocating a second array
+            audio = np.frombuffer(result.stdout, dtype=np.int16).astype(np.float32)
+            audio *= 1.0 / 32768
+            return audio
         else:
-            print(f"FFmpeg error: {result.stderr}")
+            print(f"FFmpeg error: {result.stderr.decode(errors='replace')}")
             return None
     except Exception as e:
         print(f"Error extracting audio: {e}")
@@ -269,23 +456,95 @@ def is_valid_video_url(url):
     """Check if URL is a valid video URL"""
     try:
         parsed = urlparse(url)
-        if not parsed.scheme or not parsed.netloc:
+        if parsed.scheme not in ('http', 'https') or not parsed.netloc:
             return False
         
-        # Check for common video hosting domains or file extensions
-        video_domains = ['loom.com', 'youtube.com', 'vimeo.com', 'dropbox.com', 'drive.google.com', 'googleapis.com']
-        video_extensions = ['.mp4', '.avi', '.mov', '.wmv', '.flv', '.webm']
-        
-        domain_match = any(domain in parsed.netloc.lower() for domain in video_domains)
-        extension_match = any(url.lower().endswith(ext) for ext in video_extensions)
-        
-        return domain_match or extension_match
+        return bool(VIDEO_DOMAIN_RE.search(parsed.netloc)) or url.lower().endswith(VIDEO_EXTENSIONS)
     except:
         return False
 
+class AnalysisError(Exception):
+    """Raised when a video cannot be turned into an accent prediction"""
+
+@memory.cache
+def cached_classify_audio(audio, analysis_version):
+    """Extract features from decoded audio and classify the accent, cached on disk.
+    
+    analysis_version only takes part in the cache key. Failures raise, so they are never cached.
+    """
+    # Only runs on a cache miss, so keep the cache bounded before adding to it
+    try:
+        memory.reduce_size(bytes_limit=CACHE_BYTES_LIMIT)
+    except OSError as e:
+        print(f"Could not prune the result cache: {e}")
+    
+    features = analyzer.extract_audio_features(audio, SAMPLE_RATE)
+    # A fallback may stand in for a transient error (e.g. out of memory), so raise rather
+    # than store a result the same audio would not produce on a retry
+    if features is None or features.get('used_fallback'):
+        raise AnalysisError("Failed to analyze accent from the audio")
+    return analyzer.classify_accent(features)
+
+def classify_audio(audio):
+    """Classify decoded audio, reusing results for identical audio analyzed by the same code"""
+    analysis_version = (FEATURES_VERSION, SAMPLE_RATE, FRAME_LENGTH, HOP_LENGTH, analyzer.fingerprint)
+    return cached_classify_audio(audio, analysis_version)
+
+def analyze_video_url(video_url):
+    """Run the full fetch -> decode -> classify pipeline for one video URL.
+    
+    Results are not cached per URL, since the content behind a URL can change. Repeat
+    downloads are revalidated by ETag, and classify_audio reuses results for identical audio.
+    """
+    if 'drive.google.com' in video_url:
+        # Google Drive needs its download confirmation handled first, so fetch it to a file
+        print(f"Downloading video from: {video_url}")
+        video_path = download_video(video_url)
+        if not video_path:
+            raise AnalysisError("Failed to download video. Please check the URL.")
+        
+        # Extract audio
+        print("Extracting audio...")
+        try:
+            audio = decode_audio_from_video(video_path)
+        finally:
+            try:
+                os.unlink(video_path)
+            except OSError as e:
+                print(f"Could not remove temporary video {video_path}: {e}")
+    else:
+        # Let ffmpeg stream the URL directly, overlapping the download with decoding
+        print(f"Streaming audio from: {video_url}")
+        audio = decode_audio_from_video(video_url)
+    
+    if audio is None:
+        raise AnalysisError("Failed to extract audio from video. Please check the URL and make sure ffmpeg is installed.")
+    
+    # Analyze accent
+    print("Analyzing accent...")
+    accent, confidence, explanation = classify_audio(audio)
+    if not accent:
+        raise AnalysisError("Failed to analyze accent from the audio")
+    
+    return {
+        'accent': accent,
+        'confidence': confidence,
+        'explanation': explanation
+    }
+
 # Initialize analyzer
 analyzer = AccentAnalyzer()
 
+# Every analysis runs on this pool, which also caps how many ffmpeg/librosa jobs run at once
+executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 1)
+
+# Futures for /api/analyze jobs keyed by job id; the oldest are dropped (and cancelled if
+# still queued) beyond MAX_JOBS, and new jobs are refused while MAX_PENDING_JOBS are unfinished
+MAX_JOBS = 256
+MAX_PENDING_JOBS = 4 * (os.cpu_count() or 1)
+jobs = OrderedDict()
+jobs_lock = threading.Lock()
+
 # HTML template (same as before)
 HTML_TEMPLATE = '''
 <!DOCTYPE html>
@@ -362,6 +621,12 @@ HTML_TEMPLATE = '''
 </html>
 '''
 
+# Compile the template once instead of re-parsing it on every request
+PAGE_TEMPLATE = app.jinja_env.from_string(HTML_TEMPLATE)
+
+# The plain GET page has no result or error, so it only needs rendering once
+INDEX_PAGE = PAGE_TEMPLATE.render()
+
 @app.route('/test-ffmpeg')
 def test_ffmpeg():
     try:
@@ -382,48 +647,20 @@ def index():
         video_url = request.form.get('video_url')
         
         if not video_url:
-            return render_template_string(HTML_TEMPLATE, error="Please provide a video URL")
+            return PAGE_TEMPLATE.render(error="Please provide a video URL")
         
         if not is_valid_video_url(video_url):
-            return render_template_string(HTML_TEMPLATE, error="Please provide a valid video URL")
+            return PAGE_TEMPLATE.render(error="Please provide a valid video URL")
         
         try:
-            # Download video
-            print(f"Downloading video from: {video_url}")
-            video_path = download_video(video_url)
-            if not video_path:
-                return render_template_string(HTML_TEMPLATE, error="Failed to download video. Please check the URL.")
-            
-            # Extract audio
-            print("Extracting audio...")
-            audio_path = extract_audio_from_video(video_path)
-            if not audio_path:
-                os.unlink(video_path)
-                return render_template_string(HTML_TEMPLATE, error="Failed to extract audio from video. Make sure ffmpeg is installed.")
-            
-            # Analyze accent
-            print("Analyzing accent...")
-            features = analyzer.extract_audio_features(audio_path)
-            accent, confidence, explanation = analyzer.classify_accent(features)
-            
-            # Clean up temporary files
-            os.unlink(video_path)
-            os.unlink(audio_path)
-            
-            if accent:
-                result = {
-                    'accent': accent,
-                    'confidence': confidence,
-                    'explanation': explanation
-                }
-                return render_template_string(HTML_TEMPLATE, result=result)
-            else:
-                return render_template_string(HTML_TEMPLATE, error="Failed to analyze accent from the audio")
-                
+            result = executor.submit(analyze_video_url, video_url).result()
+            return PAGE_TEMPLATE.render(result=result)
+        except AnalysisError as e:
+            return PAGE_TEMPLATE.render(error=str(e))
         except Exception as e:
-            return render_template_string(HTML_TEMPLATE, error=f"An error occurred: {str(e)}")
+            return PAGE_TEMPLATE.render(error=f"An error occurred: {str(e)}")
     
-    return render_template_string(HTML_TEMPLATE)
+    return INDEX_PAGE
 
 @app.route('/api/analyze', methods=['POST'])
 def api_analyze():
@@ -438,36 +675,40 @@ def api_analyze():
     if not is_valid_video_url(video_url):
         return jsonify({'error': 'Invalid video URL'}), 400
     
-    try:
-        # Process video
-        video_path = download_video(video_url)
-        if not video_path:
-            return jsonify({'error': 'Failed to download video'}), 400
-        
-        audio_path = extract_audio_from_video(video_path)
-        if not audio_path:
-            os.unlink(video_path)
-            return jsonify({'error': 'Failed to extract audio'}), 400
+    # Run the analysis in the background and let the client poll for the result
+    job_id = uuid.uuid4().hex
+    with jobs_lock:
+        # Bound the executor's queue so a burst of submissions can't pile up unbounded work
+        if sum(not future.done() for future in jobs.values()) >= MAX_PENDING_JOBS:
+            return jsonify({'error': 'Too many pending jobs, please retry later'}), 429
         
-        # Analyze
-        features = analyzer.extract_audio_features(audio_path)
-        accent, confidence, explanation = analyzer.classify_accent(features)
-        
-        # Cleanup
-        os.unlink(video_path)
-        os.unlink(audio_path)
-        
-        if accent:
-            return jsonify({
-                'accent': accent,
-                'confidence': confidence,
-                'explanation': explanation
-            })
-        else:
-            return jsonify({'error': 'Failed to analyze accent'}), 500
-            
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        jobs[job_id] = executor.submit(analyze_video_url, video_url)
+        while len(jobs) > MAX_JOBS:
+            # Nobody can poll an evicted job, so don't let it run if it hasn't started
+            _, evicted = jobs.popitem(last=False)
+            evicted.cancel()
+    
+    return jsonify({'job_id': job_id, 'status': 'pending'}), 202
+
+@app.route('/api/result/<job_id>', methods=['GET'])
+def api_result(job_id):
+    """Poll the status of a job started by /api/analyze"""
+    with jobs_lock:
+        future = jobs.get(job_id)
+    
+    if future is None:
+        return jsonify({'error': 'Unknown job_id'}), 404
+    
+    if not future.done():
+        return jsonify({'job_id': job_id, 'status': 'pending'}), 202
+    
+    error = future.exception()
+    if isinstance(error, AnalysisError):
+        return jsonify({'job_id': job_id, 'status': 'failed', 'error': str(error)}), 400
+    elif error is not None:
+        return jsonify({'job_id': job_id, 'status': 'failed', 'error': str(error)}), 500
+    
+    return jsonify({'job_id': job_id, 'status': 'done', **future.result()})
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))